@@ -25,34 +25,43 @@ app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.di
 app.config['ARCHIVE_FOLDER'] = os.getenv('ARCHIVE_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 1024 * 1024 * 1024))  # 1GB max file size
 
-# Clean up and create fresh directories
+# Create any missing directories
 def setup_directories():
-    # Clean up existing directories
-    if os.path.exists(app.config['UPLOAD_FOLDER']):
-        shutil.rmtree(app.config['UPLOAD_FOLDER'])
-    if os.path.exists(app.config['ARCHIVE_FOLDER']):
-        shutil.rmtree(app.config['ARCHIVE_FOLDER'])
-    
-    # Create fresh directories
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['ARCHIVE_FOLDER'], exist_ok=True)
-    os.makedirs(os.path.join(app.config['ARCHIVE_FOLDER'], 'duplicates'), exist_ok=True)
+    for folder in (app.config['UPLOAD_FOLDER'],
+                   app.config['ARCHIVE_FOLDER'],
+                   os.path.join(app.config['ARCHIVE_FOLDER'], 'duplicates')):
+        os.makedirs(folder, exist_ok=True)
     
     logger.info(f"Directories setup complete. Upload folder: {app.config['UPLOAD_FOLDER']}")
 
 setup_directories()
 
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'flv', 'wmv'}
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB write chunks
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route('/')
 def index():
-    # Clean up directories on page load
-    setup_directories()
     return render_template('index.html')
 
+@app.route('/reset', methods=['POST'])
+def reset():
+    try:
+        # Clean up existing directories and create fresh ones
+        if os.path.exists(app.config['UPLOAD_FOLDER']):
+            shutil.rmtree(app.config['UPLOAD_FOLDER'])
+        if os.path.exists(app.config['ARCHIVE_FOLDER']):
+            shutil.rmtree(app.config['ARCHIVE_FOLDER'])
+        setup_directories()
+        
+        logger.info('Upload and archive directories reset')
+        return jsonify({'message': 'Reset complete'})
+    except Exception as e:
+        logger.error(f'Error resetting directories: {str(e)}', exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'video' not in request.files:
@@ -67,19 +76,28 @@ def upload_file():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
         
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            logger.info(f'Successfully uploaded file: {filename} (Size: {file_size} bytes)')
-            return jsonify({
-                'message': 'File uploaded successfully',
-                'filename': filename,
-                'size': file_size
-            })
-        else:
-            logger.error(f'File not found after upload: {filepath}')
+        try:
+            with open(filepath, 'wb') as fh:
+                # Preallocate using the request size as an upper bound, then trim to what was written
+                if request.content_length and hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fh.fileno(), 0, request.content_length)
+                shutil.copyfileobj(file.stream, fh, length=UPLOAD_CHUNK_SIZE)
+                file_size = fh.tell()
+                fh.truncate()
+        except OSError as e:
+            # Don't leave a partial or preallocated file behind for /detect to pick up
+            logger.error(f'Error saving upload {filename}: {str(e)}')
+            if os.path.exists(filepath):
+                os.remove(filepath)
             return jsonify({'error': 'File upload failed'}), 500
+        
+        logger.info(f'Successfully uploaded file: {filename} (Size: {file_size} bytes)')
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'filename': filename,
+            'size': file_size
+        })
     
     logger.error(f'Invalid file type: {file.filename}')
     return jsonify({'error': 'Invalid file type'}), 400
@@ -87,7 +105,7 @@ def upload_file():
 @app.route('/detect', methods=['POST'])
 def detect_duplicates():
     try:
-        threshold = float(request.form.get('threshold', 0.95))
+        threshold = float(request.form.get('threshold', 0.9))
         sample_rate = int(request.form.get('sample_rate', 1))
         
         logger.info(f'Starting detection with threshold={threshold}, sample_rate={sample_rate}')
@@ -130,22 +148,24 @@ def get_results():
         logger.info(f'Checking for results in {archive_path}')
         
         if archive_path.exists():
-            txt_files = list(archive_path.glob('*.txt'))
-            logger.info(f'Found {len(txt_files)} result files')
+            # Single directory pass for both sidecars and archived videos
+            with os.scandir(archive_path) as entries:
+                names = {entry.name for entry in entries if entry.is_file()}
+            json_files = [name for name in names if name.endswith('.json')]
+            logger.info(f'Found {len(json_files)} result files')
             
-            for txt_file in txt_files:
+            for json_file in json_files:
                 try:
-                    with open(txt_file, 'r') as f:
-                        info = f.read().splitlines()
-                        video_file = txt_file.with_suffix('.mp4')
-                        if video_file.exists():
-                            results.append({
-                                'duplicate': video_file.name,
-                                'original': info[0].replace('Original file: ', ''),
-                                'archived_date': info[1].replace('Archived on: ', '')
-                            })
+                    with open(archive_path / json_file, 'r') as f:
+                        info = json.load(f)
+                    if info['duplicate'] in names:
+                        results.append({
+                            'duplicate': info['duplicate'],
+                            'original': info['original'],
+                            'archived_date': info['archived']
+                        })
                 except Exception as e:
-                    logger.error(f'Error processing result file {txt_file}: {str(e)}')
+                    logger.error(f'Error processing result file {json_file}: {str(e)}')
         else:
             logger.info('No results directory found')
         
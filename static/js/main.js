@@ -5,6 +5,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const uploadProgress = document.getElementById('upload-progress');
     const progressBar = uploadProgress.querySelector('div');
     const startDetection = document.getElementById('start-detection');
+    const resetButton = document.getElementById('reset');
     const threshold = document.getElementById('threshold');
     const thresholdValue = document.getElementById('threshold-value');
     const sampleRate = document.getElementById('sample-rate');
@@ -162,6 +163,26 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     });
 
+    // Reset uploads and archived results
+    resetButton.addEventListener('click', () => {
+        fetch('/reset', {
+            method: 'POST'
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                throw new Error(data.error);
+            }
+            fileList.innerHTML = '';
+            uploadedFiles.clear();
+            showNotification('Uploads and results cleared');
+            updateResults();
+        })
+        .catch(error => {
+            showNotification(`Reset failed: ${error.message}`, true);
+        });
+    });
+
     function updateResults() {
         resultsList.innerHTML = '<div class="text-center text-gray-600 py-4">Loading results...</div>';
         
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+import video_duplicate_detector as vdd
+from video_duplicate_detector import VideoDuplicateDetector, VideoSignature
+
+
+def _signature(frame_hashes: np.ndarray) -> VideoSignature:
+    """Build a VideoSignature from precomputed hashes without decoding a video."""
+    sig = VideoSignature.__new__(VideoSignature)
+    sig.frame_hashes = frame_hashes
+    return sig
+
+
+def _random_hashes(rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.integers(0, np.iinfo(np.int64).max, n, dtype=np.int64).astype(np.uint64)
+
+
+@pytest.mark.parametrize('tile_bytes', [vdd.COMPARE_TILE_BYTES, 8 * 200 * 4, 1])
+def test_similar_pairs_match_pairwise_compare(monkeypatch, tile_bytes):
+    # Small tiles force several tile rows and columns
+    monkeypatch.setattr(vdd, 'COMPARE_TILE_BYTES', tile_bytes)
+    rng = np.random.default_rng(0)
+    hashes = [_random_hashes(rng, n) for n in (50, 10, 200, 11, 0, 49, 10, 52)]
+    # Near-duplicate of the first video with a few flipped bits
+    hashes[5] = hashes[0][:49].copy()
+    hashes[5][::7] ^= np.uint64(3)
+
+    threshold = 0.9
+
+    pairs = VideoDuplicateDetector._similar_pairs(hashes, threshold)
+
+    expected = [(i, j) for i in range(len(hashes)) for j in range(i + 1, len(hashes))
+                if _signature(hashes[i]).compare_with(_signature(hashes[j])) >= threshold]
+    assert pairs == expected
+    assert (0, 5) in pairs
+
+
+def test_trimmed_copy_still_matches():
+    rng = np.random.default_rng(1)
+    full = _random_hashes(rng, 20)
+    trimmed = full[:2].copy()
+
+    assert _signature(full).compare_with(_signature(trimmed)) == pytest.approx(1.0)
+    assert VideoDuplicateDetector._similar_pairs([full, trimmed], 0.9) == [(0, 1)]
+
+
+def test_compare_with_early_exit_only_when_requested():
+    rng = np.random.default_rng(2)
+    a, b = _signature(_random_hashes(rng, 200)), _signature(_random_hashes(rng, 200))
+
+    score = a.compare_with(b)
+    assert 0.0 < score < 0.95
+    assert a.compare_with(b, threshold=0.95, early_exit=True) == 0.0
+    assert a.compare_with(a, threshold=0.95, early_exit=True) == pytest.approx(1.0)
+
+
+def test_reader_thread_stops_when_hashing_fails(monkeypatch, tmp_path):
+    video = str(tmp_path / 'clip.avi')
+    writer = vdd.cv2.VideoWriter(video, vdd.cv2.VideoWriter_fourcc(*'MJPG'), 30, (16, 16))
+    for i in range(100):
+        writer.write(np.full((16, 16, 3), i, dtype=np.uint8))
+    writer.release()
+
+    def failing_resize(*args, **kwargs):
+        raise vdd.cv2.error('resize failed')
+
+    monkeypatch.setattr(vdd.cv2, 'resize', failing_resize)
+    threads_before = set(vdd.threading.enumerate())
+
+    # sample_rate=0 samples every frame, so the reader fills the queue and blocks
+    with pytest.raises(vdd.cv2.error):
+        VideoSignature(video, sample_rate=0)
+
+    assert set(vdd.threading.enumerate()) == threads_before
+
+
+def test_unreadable_video_raises_and_is_not_cached(tmp_path):
+    video = tmp_path / 'broken.mp4'
+    video.write_bytes(b'not a video' * 100)
+    cache = tmp_path / 'cache.sqlite'
+
+    with pytest.raises(ValueError):
+        VideoSignature(str(video), cache_path=str(cache))
+
+    with vdd.sqlite3.connect(str(cache)) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM signatures').fetchone()[0] == 0
+
+
+def test_prune_sig_cache_drops_missing_files(tmp_path):
+    kept = tmp_path / 'kept.mp4'
+    kept.write_bytes(b'')
+    detector = VideoDuplicateDetector.__new__(VideoDuplicateDetector)
+    detector._sig_cache_path = tmp_path / 'cache.sqlite'
+    with vdd.closing(vdd._open_sig_cache(str(detector._sig_cache_path))) as conn, conn:
+        conn.executemany('INSERT INTO signatures VALUES (?, 0, 0, 1, ?)',
+                         [(str(kept), b''), (str(tmp_path / 'gone.mp4'), b'')])
+
+    detector._prune_sig_cache()
+
+    with vdd.closing(vdd._open_sig_cache(str(detector._sig_cache_path))) as conn:
+        assert conn.execute('SELECT filepath FROM signatures').fetchall() == [(str(kept),)]
@@ -1,66 +1,263 @@
 import cv2
 import numpy as np
-import imagehash
-from PIL import Image
+from scipy.fft import dctn
 import os
 import shutil
+import sqlite3
+import json
+import queue
+import threading
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import argparse
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import logging
 from datetime import datetime
+from contextlib import closing
+
+HASH_BITS = 64
+# Bump whenever frame sampling or hashing changes so cached signatures are discarded
+SIGNATURE_CACHE_VERSION = 1
+# Working-set budget for one tile of the all-pairs comparison, roughly an L2 cache
+COMPARE_TILE_BYTES = 1 << 20
+# Frames scored between early-exit checks in VideoSignature.compare_with
+COMPARE_CHUNK_FRAMES = 64
+# Decoded frames buffered between the reader thread and the hashing loop
+FRAME_QUEUE_SIZE = 32
+
+# Number of set bits in each possible byte value
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _popcount64(x: np.ndarray) -> np.ndarray:
+    """Count the set bits in each element of a uint64 array."""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POPCOUNT_TABLE[x.view(np.uint8)].reshape(x.shape + (8,)).sum(-1, dtype=np.int64)
+
+def _frame_similarity(dist: np.ndarray) -> np.ndarray:
+    """Score frame pairs from the Hamming distance between their hashes.
+    
+    Identical hashes score 1; unrelated hashes differ in about half their bits, so
+    the score falls to 0 at HASH_BITS / 2 and unrelated content lands near 0. On this
+    scale the default 0.9 threshold allows about 3 differing bits per frame.
+    """
+    return np.maximum(0.0, 1 - 2 * dist / HASH_BITS)
+
+def _open_sig_cache(cache_path: str) -> sqlite3.Connection:
+    """Open the signature cache, creating its table if needed.
+    
+    A cache written by a different SIGNATURE_CACHE_VERSION is emptied first.
+    """
+    conn = sqlite3.connect(cache_path, timeout=30)
+    try:
+        # Check the version and (re)create the table under a write lock, so one worker
+        # can't drop a table that another has just created and filled
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute('PRAGMA user_version').fetchone()[0] != SIGNATURE_CACHE_VERSION:
+            conn.execute('DROP TABLE IF EXISTS signatures')
+            conn.execute(f'PRAGMA user_version = {SIGNATURE_CACHE_VERSION}')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS signatures ('
+            'filepath TEXT, size INTEGER, mtime_ns INTEGER, sample_rate INTEGER, hashes BLOB, '
+            'PRIMARY KEY (filepath, sample_rate))'
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
 
 class VideoSignature:
-    def __init__(self, filepath: str, sample_rate: int = 1):
+    def __init__(self, filepath: str, sample_rate: int = 1, cache_path: Optional[str] = None):
         self.filepath = filepath
         self.sample_rate = sample_rate
-        self.frame_hashes = []
-        self._generate_signature()
+        self.cache_path = cache_path
+        self.frame_hashes = np.empty(0, dtype=np.uint64)
+        if not self._load_cached():
+            self._generate_signature()
+            self._store_cached()
+    
+    def _cache_key(self) -> Tuple[str, int, int, int]:
+        """Key identifying this file's contents and sampling settings in the cache."""
+        st = os.stat(self.filepath)
+        return (os.path.abspath(self.filepath), st.st_size, st.st_mtime_ns, self.sample_rate)
+    
+    def _connect_cache(self) -> sqlite3.Connection:
+        """Open the signature cache, creating its table if needed."""
+        return _open_sig_cache(self.cache_path)
+    
+    def _load_cached(self) -> bool:
+        """Load frame hashes from the cache if the file is unchanged since it was hashed."""
+        if not self.cache_path:
+            return False
+        filepath, size, mtime_ns, sample_rate = self._cache_key()
+        try:
+            with closing(self._connect_cache()) as conn:
+                row = conn.execute(
+                    'SELECT hashes FROM signatures WHERE filepath = ? AND sample_rate = ? '
+                    'AND size = ? AND mtime_ns = ?',
+                    (filepath, sample_rate, size, mtime_ns)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Signature cache unavailable, recomputing {self.filepath}: {str(e)}")
+            return False
+        if row is None:
+            return False
+        self.frame_hashes = np.frombuffer(row[0], dtype=np.uint64).copy()
+        return True
+    
+    def _store_cached(self):
+        """Store the frame hashes in the cache."""
+        if not self.cache_path:
+            return
+        try:
+            with closing(self._connect_cache()) as conn, conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?)',
+                    (*self._cache_key(), self.frame_hashes.tobytes())
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"Could not cache signature for {self.filepath}: {str(e)}")
     
     def _generate_signature(self):
         """Generate a signature for the video by hashing sampled frames."""
         cap = cv2.VideoCapture(self.filepath)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video {self.filepath}")
         fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
         # Calculate frames to sample
-        sample_interval = int(fps * self.sample_rate)
-        
-        for frame_idx in range(0, frame_count, sample_interval):
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = cap.read()
-            if ret:
-                # Convert BGR to RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                # Convert to PIL Image
-                pil_image = Image.fromarray(frame_rgb)
-                # Calculate perceptual hash
-                frame_hash = str(imagehash.average_hash(pil_image))
-                self.frame_hashes.append(frame_hash)
-        
-        cap.release()
+        sample_interval = max(1, int(fps * self.sample_rate))
+        
+        # Thumbnail batch sized from the reported frame count, grown only if that was short
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        thumbs = np.empty((max(1, frame_count // sample_interval + 1), 32, 32, 3), dtype=np.uint8)
+        num_thumbs = 0
+        
+        # Decode on a reader thread so disk reads and decoding overlap with hashing here
+        frames = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_frames, args=(cap, sample_interval, frames, stop),
+                                  daemon=True)
+        reader.start()
+        try:
+            while (frame := frames.get()) is not None:
+                if num_thumbs == len(thumbs):
+                    thumbs = np.concatenate([thumbs, np.empty_like(thumbs)])
+                # Keep a 32x32 thumbnail for the DCT hash
+                cv2.resize(frame, (32, 32), dst=thumbs[num_thumbs], interpolation=cv2.INTER_AREA)
+                num_thumbs += 1
+        finally:
+            # Stop the reader even if hashing failed, so the thread and decoder don't
+            # outlive this call in a reused pool worker
+            stop.set()
+            while True:
+                try:
+                    frames.get_nowait()
+                except queue.Empty:
+                    break
+            reader.join()
+            cap.release()
+        self.frame_hashes = self._phash(thumbs[:num_thumbs])
+
+    @staticmethod
+    def _put_frame(frames: queue.Queue, item: Optional[np.ndarray], stop: threading.Event) -> bool:
+        """Put an item on the queue, giving up once stop is set. Returns whether it was queued."""
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    @staticmethod
+    def _read_frames(cap: cv2.VideoCapture, sample_interval: int, frames: queue.Queue,
+                     stop: threading.Event):
+        """Decode every sample_interval-th frame into the queue, then a None sentinel.
+        
+        Returns early, without the sentinel, once stop is set.
+        """
+        # Frames are decoded into a pool of reused buffers. The queue bound guarantees
+        # the consumer is done with a buffer before it comes around again.
+        pool = [None] * (frames.maxsize + 2)
+        slot = 0
+        try:
+            # Read the stream sequentially instead of seeking to each sampled
+            # frame, which would force a re-decode from the nearest keyframe
+            while not stop.is_set() and cap.grab():
+                ret, pool[slot] = cap.retrieve(pool[slot])
+                if ret:
+                    if not VideoSignature._put_frame(frames, pool[slot], stop):
+                        return
+                    slot = (slot + 1) % len(pool)
+                # Advance to the next sampled frame without retrieving the ones in between
+                for _ in range(sample_interval - 1):
+                    if not cap.grab():
+                        return
+        finally:
+            VideoSignature._put_frame(frames, None, stop)
+    
+    @staticmethod
+    def _phash(thumbs: np.ndarray) -> np.ndarray:
+        """Compute 64-bit DCT perceptual hashes for a (F, 32, 32, 3) batch of BGR thumbnails."""
+        if not len(thumbs):
+            return np.empty(0, dtype=np.uint64)
+        
+        # Convert the whole batch to grayscale in one call by viewing it as a single tall image
+        gray = cv2.cvtColor(thumbs.reshape(-1, 32, 3), cv2.COLOR_BGR2GRAY).reshape(-1, 32, 32)
+        
+        # One batched 2D DCT over all frames, keeping the 8x8 low-frequency block
+        batch = gray.astype(np.float32)
+        dct = dctn(batch, type=2, axes=(1, 2), norm='ortho')[:, :8, :8].reshape(-1, 64)
+        # Threshold each frame by its median, excluding the DC term
+        median = np.median(dct[:, 1:], axis=1, keepdims=True)
+        bits = dct > median
+        return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
 
-    def compare_with(self, other: 'VideoSignature', threshold: float = 0.95) -> float:
-        """Compare this video signature with another one."""
-        if not self.frame_hashes or not other.frame_hashes:
+    def compare_with(self, other: 'VideoSignature', threshold: float = 0.9,
+                     early_exit: bool = False) -> float:
+        """Compare this video signature with another one.
+        
+        With early_exit, returns 0.0 as soon as the similarity can no longer reach
+        the threshold instead of finishing the comparison.
+        """
+        if not len(self.frame_hashes) or not len(other.frame_hashes):
             return 0.0
         
-        # Compare frame hashes
+        # Score each frame pair by the Hamming distance between their hashes, a chunk at a
+        # time, optionally stopping once even perfect remaining frames could not reach the threshold
         min_len = min(len(self.frame_hashes), len(other.frame_hashes))
-        matches = sum(1 for i in range(min_len) 
-                     if self.frame_hashes[i] == other.frame_hashes[i])
+        required = threshold * min_len
+        score = 0.0
+        for start in range(0, min_len, COMPARE_CHUNK_FRAMES):
+            end = min(start + COMPARE_CHUNK_FRAMES, min_len)
+            dist = _popcount64(self.frame_hashes[start:end] ^ other.frame_hashes[start:end])
+            score += float(_frame_similarity(dist).sum())
+            if early_exit and score + (min_len - end) < required:
+                return 0.0
         
-        return matches / min_len
+        return score / min_len
+
+def _init_worker():
+    """Keep each pool worker's OpenCV to one thread; the pool itself provides the parallelism."""
+    cv2.setNumThreads(1)
+
+def _make_sig(args: Tuple[str, int, Optional[str]]) -> np.ndarray:
+    """Build a VideoSignature in a worker process and return its frame hashes."""
+    filepath, sample_rate, cache_path = args
+    return VideoSignature(filepath, sample_rate, cache_path).frame_hashes
 
 class VideoDuplicateDetector:
-    def __init__(self, input_dir: str, output_dir: str, threshold: float = 0.95, 
+    def __init__(self, input_dir: str, output_dir: str, threshold: float = 0.9, 
                  sample_rate: int = 1):
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.threshold = threshold
         self.sample_rate = sample_rate
         self.video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv'}
+        self._sig_cache_path = self.output_dir / '.sig_cache.sqlite'
         
         # Setup logging
         self._setup_logging()
@@ -80,8 +277,15 @@ class VideoDuplicateDetector:
     def _get_video_files(self) -> List[Path]:
         """Get all video files from the input directory."""
         video_files = []
-        for ext in self.video_extensions:
-            video_files.extend(self.input_dir.glob(f'**/*{ext}'))
+        # Walk the tree once, matching extensions inline
+        stack = [self.input_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in self.video_extensions:
+                        video_files.append(Path(entry.path))
         return video_files
     
     def _archive_duplicate(self, duplicate_file: Path, original_file: Path):
@@ -92,11 +296,75 @@ class VideoDuplicateDetector:
         # Move the file to archive
         shutil.move(str(duplicate_file), str(archive_path))
         
-        # Create a text file with original file information
-        info_file = archive_path.with_suffix('.txt')
+        # Create a JSON sidecar with original file information
+        info_file = archive_path.with_suffix('.json')
         with open(info_file, 'w') as f:
-            f.write(f'Original file: {original_file}\n')
-            f.write(f'Archived on: {datetime.now():%Y-%m-%d %H:%M:%S}\n')
+            json.dump({
+                'original': str(original_file),
+                'archived': f'{datetime.now():%Y-%m-%d %H:%M:%S}',
+                'duplicate': archive_path.name
+            }, f)
+    
+    def _prune_sig_cache(self):
+        """Drop cached signatures for files that no longer exist, e.g. archived duplicates."""
+        try:
+            with closing(_open_sig_cache(str(self._sig_cache_path))) as conn, conn:
+                stale = [(filepath,) for (filepath,) in conn.execute('SELECT DISTINCT filepath FROM signatures')
+                         if not os.path.exists(filepath)]
+                conn.executemany('DELETE FROM signatures WHERE filepath = ?', stale)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not prune signature cache: {str(e)}")
+    
+    @staticmethod
+    def _stack_signatures(sigs: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Lay out all frame hashes in one padded (num_videos, max_frames) matrix plus their lengths."""
+        lengths = np.array([len(s) for s in sigs], dtype=np.int64)
+        max_len = int(lengths.max()) if len(sigs) else 0
+        hashes = np.full((len(sigs), max_len), np.iinfo(np.uint64).max, dtype=np.uint64)
+        for i, s in enumerate(sigs):
+            hashes[i, :lengths[i]] = s
+        return hashes, lengths
+    
+    @staticmethod
+    def _similar_pairs(sigs: List[np.ndarray], threshold: float) -> List[Tuple[int, int]]:
+        """Find all index pairs (i, j), i < j, whose Hamming similarity reaches the threshold.
+        
+        Pairs are returned in lexicographic order.
+        """
+        hashes, lengths = VideoDuplicateDetector._stack_signatures(sigs)
+        num_videos, max_len = hashes.shape
+        valid = np.arange(max_len) < lengths[:, None]
+        
+        # The comparison does almost no arithmetic per loaded hash, so it is bound by
+        # memory traffic rather than compute. Work through it in square tiles whose
+        # (block, block, max_len) intermediates stay cache-resident instead of
+        # materialising the full (N, N, max_len) broadcast, and keep only the pairs
+        # that pass so nothing of size N x N is ever allocated.
+        block = max(1, int(np.sqrt(COMPARE_TILE_BYTES / (8 * max(max_len, 1)))))
+        first, second = [], []
+        for i0 in range(0, num_videos, block):
+            rows, rows_valid, rows_len = hashes[i0:i0 + block], valid[i0:i0 + block], lengths[i0:i0 + block]
+            for j0 in range(i0, num_videos, block):
+                cols, cols_valid, cols_len = hashes[j0:j0 + block], valid[j0:j0 + block], lengths[j0:j0 + block]
+                # Only frame positions present in both videos contribute to the score
+                frame_sim = _frame_similarity(_popcount64(rows[:, None, :] ^ cols[None, :, :]))
+                frame_sim *= rows_valid[:, None, :] & cols_valid[None, :, :]
+                min_len = np.minimum(rows_len[:, None], cols_len[None, :])
+                sim = np.divide(frame_sim.sum(-1), min_len, out=np.zeros(min_len.shape), where=min_len > 0)
+                
+                passed = sim >= threshold
+                if j0 == i0:
+                    # Diagonal tiles: keep only j > i
+                    passed &= np.triu(np.ones_like(passed), 1)
+                i, j = np.nonzero(passed)
+                first.append(i + i0)
+                second.append(j + j0)
+        
+        if not first:
+            return []
+        first, second = np.concatenate(first), np.concatenate(second)
+        order = np.lexsort((second, first))
+        return list(zip(first[order].tolist(), second[order].tolist()))
     
     def detect_and_archive(self):
         """Main method to detect and archive duplicate videos."""
@@ -108,40 +376,48 @@ class VideoDuplicateDetector:
         # Create output directory if it doesn't exist
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
+        self._prune_sig_cache()
+        
         # Generate signatures for all videos
-        signatures: Dict[Path, VideoSignature] = {}
+        signatures: Dict[Path, np.ndarray] = {}
         logging.info("Generating video signatures...")
-        for video_file in tqdm(video_files, desc="Processing videos"):
-            try:
-                signatures[video_file] = VideoSignature(str(video_file), self.sample_rate)
-            except Exception as e:
-                logging.error(f"Error processing {video_file}: {str(e)}")
+        # Spawn rather than fork: the web app runs under gevent-patched gunicorn workers,
+        # and forking from a monkey-patched process can hang the pool
+        with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker) as executor:
+            futures = {executor.submit(_make_sig, (str(video_file), self.sample_rate,
+                                                  str(self._sig_cache_path))): video_file
+                       for video_file in video_files}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing videos"):
+                video_file = futures[future]
+                try:
+                    signatures[video_file] = future.result()
+                except Exception as e:
+                    logging.error(f"Error processing {video_file}: {str(e)}")
         
         # Find and process duplicates
         duplicates_found = False
         processed_files = set()
         
         logging.info("Comparing videos for duplicates...")
-        for file1 in tqdm(video_files, desc="Comparing videos"):
-            if file1 in processed_files:
+        files = [f for f in video_files if f in signatures]
+        pairs = self._similar_pairs([signatures[f] for f in files], self.threshold)
+        
+        for i, j in tqdm(pairs, desc="Comparing videos"):
+            file1, file2 = files[i], files[j]
+            if file1 in processed_files or file2 in processed_files:
                 continue
-                
-            for file2 in video_files:
-                if file1 == file2 or file2 in processed_files:
-                    continue
-                
-                similarity = signatures[file1].compare_with(signatures[file2], self.threshold)
-                
-                if similarity >= self.threshold:
-                    duplicates_found = True
-                    processed_files.add(file2)
-                    
-                    # Keep the older file as original
-                    original = file1 if file1.stat().st_mtime < file2.stat().st_mtime else file2
-                    duplicate = file2 if original == file1 else file1
-                    
-                    logging.info(f"Found duplicate:\nOriginal: {original}\nDuplicate: {duplicate}")
-                    self._archive_duplicate(duplicate, original)
+            
+            duplicates_found = True
+            processed_files.add(file2)
+            
+            # Keep the older file as original
+            original = file1 if file1.stat().st_mtime < file2.stat().st_mtime else file2
+            duplicate = file2 if original == file1 else file1
+            
+            logging.info(f"Found duplicate:\nOriginal: {original}\nDuplicate: {duplicate}")
+            self._archive_duplicate(duplicate, original)
         
         if not duplicates_found:
             logging.info("No duplicates found!")
@@ -152,7 +428,7 @@ def main():
     parser = argparse.ArgumentParser(description='Detect and archive duplicate videos')
     parser.add_argument('--input_dir', required=True, help='Input directory containing videos')
     parser.add_argument('--output_dir', required=True, help='Output directory for archived duplicates')
-    parser.add_argument('--threshold', type=float, default=0.95, 
+    parser.add_argument('--threshold', type=float, default=0.9, 
                        help='Similarity threshold (0.0 to 1.0)')
     parser.add_argument('--sample_rate', type=int, default=1,
                        help='Frame sampling rate in seconds')